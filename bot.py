@@ -1,17 +1,41 @@
-import os
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
 import discord
-import aiohttp
 from discord.ext import commands, tasks
 from steam_api import SteamAPI
 from config import Config
-from utils import setup_logging, log_command
+from utils import setup_logging, log_command, INFO, WARNING, ERROR
 from tracker import GameTracker
-import logging
-from datetime import datetime
 
 # Set up logging
 logger = setup_logging()
 
+# How long to wait before re-checking a tracked game, in seconds
+UNRELEASED_CHECK_INTERVAL = 30 * 60  # coming soon / pre-order titles
+PRICED_CHECK_INTERVAL = 2 * 60 * 60  # released titles with a store price
+RELEASED_CHECK_INTERVAL = 6 * 60 * 60
+CHECK_JITTER = 0.2                   # fraction of the interval added at random
+
+# discord.Color.blue(), for embeds built with Embed.from_dict
+EMBED_COLOR = 0x3498db
+MAX_EMBEDS_PER_MESSAGE = 10
+
+def _deep_get(data, *keys, default=None):
+    """Look up a nested key path, returning default if any level is missing"""
+    try:
+        for key in keys:
+            data = data[key]
+    except (KeyError, TypeError):
+        return default
+    return data
+
 # Set up required intents
 intents = discord.Intents.default()
 intents.message_content = True
@@ -22,22 +46,9 @@ class CustomHelpCommand(commands.HelpCommand):
     """Custom help command with detailed information"""
     async def send_bot_help(self, mapping):
         user_info = f"{self.context.author} (ID: {self.context.author.id})"
-        log_command(logger, logging.INFO, "Help command executed", user=user_info, command="!help")
-        
-        embed = discord.Embed(
-            title="🎮 Steam Bot Commands",
-            description="Monitor and get notified about Steam game releases!",
-            color=discord.Color.blue()
-        )
-        
-        commands = [c for c in self.context.bot.commands]
-        for cmd in sorted(commands, key=lambda x: x.name):
-            embed.add_field(
-                name=f"`{self.context.clean_prefix}{cmd.name}`",
-                value=cmd.help or "No description available",
-                inline=False
-            )
+        log_command(logger, INFO, "Help command executed", user=user_info, command="!help")
         
+        embed = discord.Embed.from_dict(self.context.bot.build_help_embed_dict(self.context.clean_prefix))
         await self.get_destination().send(embed=embed)
 
 class SteamBot(commands.Bot):
@@ -49,58 +60,173 @@ class SteamBot(commands.Bot):
         )
         self.steam = SteamAPI()
         self.tracker = GameTracker()
+        # Min-heap of (next_check, game_id) driving check_tracked_games
+        self._check_queue = []
+        self._scheduled = set()
+        self._help_entries = []
         
     async def setup_hook(self):
         """Initialize bot and start background tasks"""
-        log_command(logger, logging.INFO, "Initializing bot and connecting to Steam API")
+        log_command(logger, INFO, "Initializing bot and connecting to Steam API")
         await self.steam.start()
         self.check_tracked_games.start()
-        log_command(logger, logging.INFO, "Bot is ready and connected to Steam API")
+        # Commands are all registered by now and never change afterwards
+        self._help_entries = [
+            (cmd.name, cmd.help or "No description available")
+            for cmd in sorted(self.commands, key=lambda x: x.name)
+        ]
+        log_command(logger, INFO, "Bot is ready and connected to Steam API")
+
+    def build_help_embed_dict(self, prefix):
+        """Build the !help embed payload, showing commands with the prefix that was used"""
+        return {
+            'title': "🎮 Steam Bot Commands",
+            'description': "Monitor and get notified about Steam game releases!",
+            'color': EMBED_COLOR,
+            'fields': [
+                {
+                    'name': f"`{prefix}{name}`",
+                    'value': help_text,
+                    'inline': False
+                }
+                for name, help_text in self._help_entries
+            ]
+        }
+
+    async def close(self):
+        """Stop background tasks, release the Steam API session and save tracking data"""
+        self.check_tracked_games.cancel()
+        await self.steam.close()
+        self.tracker.flush()
+        await super().close()
         
-    @tasks.loop(minutes=30)
+    @tasks.loop(seconds=30)
     async def check_tracked_games(self):
-        """Check for updates to tracked games"""
+        """Check tracked games whose next update check is due"""
         try:
-            log_command(logger, logging.INFO, "Checking tracked games for updates")
-            games = self.tracker.get_tracked_games()
+            games = {game['id']: game for game in self.tracker.get_tracked_games()}
+            now = time.monotonic()
             
-            for game in games:
-                # Get latest game data from Steam
-                store_url = f"https://store.steampowered.com/api/appdetails?appids={game['id']}"
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(store_url) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            game_data = data.get(str(game['id']), {}).get('data', {})
-                            
-                            if game_data:
-                                # Update tracker with new data
-                                notifications = self.tracker.update_game_data(
-                                    game['id'],
-                                    price=game_data.get('price_overview', {}).get('final_formatted'),
-                                    release_date=game_data.get('release_date', {}).get('date'),
-                                    preorder_status=game_data.get('release_date', {}).get('coming_soon', False),
-                                    last_update=datetime.now().isoformat()
-                                )
-                                
-                                # Send notifications if there are changes
-                                if notifications:
-                                    channels = self.tracker.get_notification_channels(game['id'])
-                                    for channel_data in channels:
-                                        channel = self.get_channel(channel_data['channel_id'])
-                                        if channel:
-                                            for notif in notifications:
-                                                users_mention = " ".join(f"<@{user_id}>" for user_id in channel_data['users'])
-                                                embed = discord.Embed(
-                                                    title=f"Game Update: {game['name']}",
-                                                    description=notif['message'],
-                                                    color=discord.Color.blue(),
-                                                    timestamp=datetime.now()
-                                                )
-                                                await channel.send(users_mention, embed=embed)
+            # Newly tracked games are checked right away
+            for game_id in games.keys() - self._scheduled:
+                heapq.heappush(self._check_queue, (now, game_id))
+                self._scheduled.add(game_id)
+                
+            due = []
+            while self._check_queue and self._check_queue[0][0] <= now:
+                _, game_id = heapq.heappop(self._check_queue)
+                if game_id in games:
+                    due.append(games[game_id])
+                else:
+                    # No longer tracked
+                    self._scheduled.discard(game_id)
+                    
+            if not due:
+                return
+                
+            # Popped games must go back on the heap even if this tick fails part way,
+            # otherwise they stay in _scheduled and are never checked again
+            pending = {game['id'] for game in due}
+            try:
+                log_command(logger, INFO, f"Checking {len(due)} tracked games for updates")
+                # appdetails only accepts several appids for the price_overview filter alone,
+                # so each game is fetched on its own, concurrently
+                details = await asyncio.gather(
+                    *(self.steam.get_app_details(game['id']) for game in due),
+                    return_exceptions=True
+                )
+                
+                # One clock reading is shared by every game this tick
+                tick_time = datetime.now().astimezone()
+                now_ts = int(tick_time.timestamp())
+                timestamp = tick_time.isoformat()
+                
+                # channel_id -> watching users -> embeds, so each channel gets as few messages as possible
+                by_channel = defaultdict(lambda: defaultdict(list))
+                now = time.monotonic()
+                for game, game_data in zip(due, details):
+                    if isinstance(game_data, Exception):
+                        log_command(logger, WARNING, f"Failed to fetch details for {game['name']}: {str(game_data)}")
+                        game_data = None
+                    try:
+                        interval, embeds = self._refresh_tracked_game(game, game_data, now_ts, timestamp)
+                        if embeds:
+                            for channel_data in self.tracker.get_notification_channels(game['id']):
+                                users = tuple(sorted(channel_data['users']))
+                                by_channel[channel_data['channel_id']][users].extend(embeds)
+                    except Exception as e:
+                        log_command(logger, WARNING, f"Failed to refresh {game['name']}: {str(e)}")
+                        interval = UNRELEASED_CHECK_INTERVAL
+                    self._schedule_check(game['id'], now, interval)
+                    pending.discard(game['id'])
+            finally:
+                now = time.monotonic()
+                for game_id in pending:
+                    self._schedule_check(game_id, now, UNRELEASED_CHECK_INTERVAL)
+            
+            # Persist all updates from this tick in one write, off the event loop
+            await asyncio.to_thread(self.tracker.flush)
+            
+            results = await asyncio.gather(
+                *(self._send_notifications(channel_id, groups) for channel_id, groups in by_channel.items()),
+                return_exceptions=True
+            )
+            for channel_id, result in zip(by_channel, results):
+                if isinstance(result, Exception):
+                    log_command(logger, WARNING, f"Failed to notify channel {channel_id}: {str(result)}")
                 
         except Exception as e:
-            log_command(logger, logging.ERROR, f"Error checking tracked games: {str(e)}")
+            log_command(logger, ERROR, f"Error checking tracked games: {str(e)}")
+
+    def _schedule_check(self, game_id, now, interval):
+        """Queue a game's next update check interval seconds (plus jitter) from now"""
+        next_check = now + interval + random.uniform(0, interval * CHECK_JITTER)
+        heapq.heappush(self._check_queue, (next_check, game_id))
+
+    def _refresh_tracked_game(self, game, game_data, now_ts, timestamp):
+        """Apply the latest Steam data for a tracked game and return the number of
+        seconds until it should be checked again along with any notification embeds"""
+        if not game_data:
+            return UNRELEASED_CHECK_INTERVAL, []
+            
+        coming_soon = _deep_get(game_data, 'release_date', 'coming_soon', default=False)
+        
+        # Update tracker with new data
+        notifications = self.tracker.update_game_data(
+            game['id'],
+            price=_deep_get(game_data, 'price_overview', 'final_formatted'),
+            release_date=_deep_get(game_data, 'release_date', 'date'),
+            preorder_status=coming_soon,
+            last_update=now_ts
+        )
+        
+        embeds = [
+            discord.Embed.from_dict({
+                'title': f"Game Update: {game['name']}",
+                'description': notif['message'],
+                'color': EMBED_COLOR,
+                'timestamp': timestamp
+            })
+            for notif in notifications
+        ]
+
+        if coming_soon:
+            return UNRELEASED_CHECK_INTERVAL, embeds
+        if game_data.get('price_overview'):
+            return PRICED_CHECK_INTERVAL, embeds
+        return RELEASED_CHECK_INTERVAL, embeds
+
+    async def _send_notifications(self, channel_id, groups):
+        """Send a channel's update embeds, one message per group of watchers"""
+        channel = self.get_channel(channel_id)
+        if not channel:
+            return
+            
+        for users, embeds in groups.items():
+            users_mention = " ".join(f"<@{user_id}>" for user_id in users)
+            # Discord accepts at most 10 embeds per message
+            for i in range(0, len(embeds), MAX_EMBEDS_PER_MESSAGE):
+                await channel.send(users_mention, embeds=embeds[i:i + MAX_EMBEDS_PER_MESSAGE])
 
 bot = SteamBot()
 
@@ -150,9 +276,12 @@ async def track(ctx, *, game_name: str = None):
             
         return await ctx.send(embed=embed)
     
-    async with ctx.typing():
+    # The typing indicator is its own REST call, so skip it when the search is already cached
+    # (an empty AsyncExitStack is a no-op async context manager)
+    typing = contextlib.AsyncExitStack() if bot.steam.is_search_cached(game_name) else ctx.typing()
+    async with typing:
         try:
-            log_command(logger, logging.INFO, f"Searching for game to track: {game_name}", user=user_info, command=cmd_info)
+            log_command(logger, INFO, f"Searching for game to track: {game_name}", user=user_info, command=cmd_info)
             
             # Search for the game
             games = await bot.steam.search_games(game_name)
@@ -169,8 +298,8 @@ async def track(ctx, *, game_name: str = None):
             # Get details for the first match
             game = games[0]
             success = bot.tracker.track_game(
-                game_id=int(game['appid']),
-                game_name=game['name'],
+                game_id=int(game.appid),
+                game_name=game.name,
                 channel_id=ctx.channel.id,
                 user_id=ctx.author.id
             )
@@ -178,7 +307,7 @@ async def track(ctx, *, game_name: str = None):
             if success:
                 embed = discord.Embed(
                     title="✅ Game Tracked",
-                    description=f"Now tracking **{game['name']}**!\n\n"
+                    description=f"Now tracking **{game.name}**!\n\n"
                               f"You'll be notified in this channel about:\n"
                               f"📅 Release date changes\n"
                               f"💰 Price updates\n"
@@ -186,8 +315,8 @@ async def track(ctx, *, game_name: str = None):
                               f"📢 Major updates",
                     color=discord.Color.green()
                 )
-                log_command(logger, logging.INFO, 
-                          f"Successfully tracking {game['name']}", 
+                log_command(logger, INFO, 
+                          f"Successfully tracking {game.name}", 
                           user=user_info, 
                           command=cmd_info)
             else:
@@ -196,15 +325,15 @@ async def track(ctx, *, game_name: str = None):
                     description="Failed to start tracking the game. Please try again later.",
                     color=discord.Color.red()
                 )
-                log_command(logger, logging.ERROR, 
-                          f"Failed to track {game['name']}", 
+                log_command(logger, ERROR, 
+                          f"Failed to track {game.name}", 
                           user=user_info, 
                           command=cmd_info)
             
             await ctx.send(embed=embed)
             
         except Exception as e:
-            log_command(logger, logging.ERROR, f"Track command failed: {str(e)}", user=user_info, command=cmd_info)
+            log_command(logger, ERROR, f"Track command failed: {str(e)}", user=user_info, command=cmd_info)
             embed = discord.Embed(
                 title="❌ Error",
                 description="An error occurred while trying to track the game. Please try again later.",
@@ -232,7 +361,7 @@ async def playercount(ctx, *, query: str = None):
         try:
             if query is None:
                 # Show top 10 games
-                log_command(logger, logging.INFO, "Fetching top 10 games", user=user_info, command=cmd_info)
+                log_command(logger, INFO, "Fetching top 10 games", user=user_info, command=cmd_info)
                 games = await bot.steam.get_top_games(limit=10)
                 
                 if not games:
@@ -243,31 +372,29 @@ async def playercount(ctx, *, query: str = None):
                     )
                     return await ctx.send(embed=embed)
                 
-                embed = discord.Embed(
-                    title="🎮 Top Steam Games",
-                    description="Current most played games on Steam",
-                    color=discord.Color.blue(),
-                    timestamp=ctx.message.created_at
-                )
-                
-                for i, game in enumerate(games, 1):
-                    player_count = f"{game['player_count']:,}"
-                    peak_today = f"{game['peak_today']:,}"
-                    embed.add_field(
-                        name=f"{i}. {game['name']}",
-                        value=f"Current Players: **{player_count}**\n"
-                              f"Peak Today: **{peak_today}**",
-                        inline=False
-                    )
-                
-                embed.set_footer(text="Data from Steam • Updated in real-time")
-                log_command(logger, logging.INFO, 
+                embed = discord.Embed.from_dict({
+                    'title': "🎮 Top Steam Games",
+                    'description': "Current most played games on Steam",
+                    'color': EMBED_COLOR,
+                    'timestamp': ctx.message.created_at.isoformat(),
+                    'fields': [
+                        {
+                            'name': f"{i}. {game.name}",
+                            'value': f"Current Players: **{game.player_count:,}**\n"
+                                     f"Peak Today: **{game.peak_today:,}**",
+                            'inline': False
+                        }
+                        for i, game in enumerate(games, 1)
+                    ],
+                    'footer': {'text': "Data from Steam • Updated in real-time"}
+                })
+                log_command(logger, INFO, 
                           f"Successfully fetched top games (found {len(games)})", 
                           user=user_info, 
                           command=cmd_info)
             else:
                 # Search for specific game
-                log_command(logger, logging.INFO, f"Searching for game: {query}", user=user_info, command=cmd_info)
+                log_command(logger, INFO, f"Searching for game: {query}", user=user_info, command=cmd_info)
                 games = await bot.steam.search_games(query)
                 
                 if not games:
@@ -285,28 +412,32 @@ async def playercount(ctx, *, query: str = None):
                     timestamp=ctx.message.created_at
                 )
                 
-                for game in games[:5]:
-                    try:
-                        stats = await bot.steam.get_player_count(game['appid'])
-                        player_count = f"{stats['player_count']:,}"
-                        embed.add_field(
-                            name=game['name'],
-                            value=f"Current Players: **{player_count}**",
-                            inline=False
-                        )
-                    except Exception as e:
+                games = games[:5]
+                stats = await asyncio.gather(
+                    *(bot.steam.get_player_count(game.appid) for game in games),
+                    return_exceptions=True
+                )
+                for game, game_stats in zip(games, stats):
+                    if isinstance(game_stats, Exception):
                         embed.add_field(
-                            name=game['name'],
+                            name=game.name,
                             value="Unable to fetch player count",
                             inline=False
                         )
+                        continue
+                    player_count = f"{game_stats['player_count']:,}"
+                    embed.add_field(
+                        name=game.name,
+                        value=f"Current Players: **{player_count}**",
+                        inline=False
+                    )
                 
                 embed.set_footer(text="Data from Steam • Updated in real-time")
             
             await ctx.send(embed=embed)
             
         except Exception as e:
-            log_command(logger, logging.ERROR, f"Command failed: {str(e)}", user=user_info, command=cmd_info)
+            log_command(logger, ERROR, f"Command failed: {str(e)}", user=user_info, command=cmd_info)
             embed = discord.Embed(
                 title="❌ Error",
                 description="An error occurred while fetching player counts. Please try again later.",
@@ -315,5 +446,5 @@ async def playercount(ctx, *, query: str = None):
             await ctx.send(embed=embed)
 
 if __name__ == "__main__":
-    log_command(logger, logging.INFO, "Starting Steam Bot...")
+    log_command(logger, INFO, "Starting Steam Bot...")
     bot.run(Config.DISCORD_TOKEN)
\ No newline at end of file
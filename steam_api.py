@@ -1,16 +1,74 @@
-import os
+from __future__ import annotations
+
 import aiohttp
 import asyncio
-import json
+import heapq
+import orjson
+import random
+import time
+from collections import OrderedDict
 from config import Config
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
-from utils import setup_logging, log_command
-import logging
+from typing import Optional, Dict, List, NamedTuple, Tuple
+from utils import setup_logging, log_command, DEBUG, INFO, WARNING, ERROR
 
 # Set up logging
 logger = setup_logging()
 
+# Search results are cached for SEARCH_TTL seconds, keeping at most SEARCH_CACHE_SIZE queries
+SEARCH_TTL = 3600
+SEARCH_CACHE_SIZE = 256
+APPLIST_REFRESH_INTERVAL = 6 * 60 * 60
+# Backoff for retrying a failed app list download, doubling up to the max
+APPLIST_RETRY_DELAY = 60
+APPLIST_MAX_RETRY_DELAY = 30 * 60
+
+# Store appdetails fields used by the tracker
+APPDETAILS_FILTERS = "basic,price_overview,release_date"
+
+# Outbound request pacing shared by the Web API and Store API
+MAX_CONCURRENT_REQUESTS = 8
+MIN_REQUEST_INTERVAL = 0.1  # seconds between request starts
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_JITTER = 0.5
+MAX_RETRY_DELAY = 60.0
+
+# Fail fast instead of pinning a request slot on a stalled Steam endpoint
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3, sock_read=7)
+# The full app list is several megabytes
+APPLIST_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=3, sock_read=15)
+
+class GameInfo(NamedTuple):
+    """A Steam game as returned by search_games and get_top_games"""
+    appid: int
+    name: str
+    player_count: int = 0
+    peak_today: int = 0
+    header_image: str = ''
+    genres: Tuple[str, ...] = ()
+
+# Most popular Steam games, with the store metadata shown by get_top_games
+POPULAR_GAMES = [
+    GameInfo(appid, name, header_image=f"https://cdn.akamai.steamstatic.com/steam/apps/{appid}/header.jpg", genres=genres)
+    for appid, name, genres in [
+        (730, "Counter-Strike 2", ("Action", "Free To Play")),
+        (570, "Dota 2", ("Action", "Strategy", "Free To Play")),
+        (440, "Team Fortress 2", ("Action", "Free To Play")),
+        (578080, "PUBG: BATTLEGROUNDS", ("Action", "Adventure", "Massively Multiplayer", "Free To Play")),
+        (252490, "Rust", ("Action", "Adventure", "Indie", "Massively Multiplayer", "RPG")),
+        (1172470, "Apex Legends™", ("Action", "Adventure", "Free To Play")),
+        (1938090, "Call of Duty®", ("Action",)),
+        (346110, "ARK: Survival Evolved", ("Action", "Adventure", "Indie", "Massively Multiplayer", "RPG")),
+        (271590, "Grand Theft Auto V", ("Action", "Adventure")),
+        (1599340, "Lost Ark", ("Action", "Adventure", "Massively Multiplayer", "RPG", "Free To Play")),
+        (1086940, "Baldur's Gate 3", ("Adventure", "RPG", "Strategy")),
+        (359550, "Tom Clancy's Rainbow Six® Siege", ("Action",)),
+        (230410, "Warframe", ("Action", "Free To Play")),
+        (548430, "Deep Rock Galactic", ("Action",)),
+        (1623730, "Palworld", ("Action", "Adventure", "Indie", "RPG", "Early Access")),
+    ]
+]
+
 class SteamAPIError(Exception):
     """Base exception for Steam API errors"""
     def __init__(self, message: str, status_code: Optional[int] = None):
@@ -21,197 +79,285 @@ class SteamAPI:
     def __init__(self):
         self.base_url = "https://api.steampowered.com"
         self.session = None
-        self.rate_limit_remaining = 10
-        self.retry_delay = 5.0
+        self._rate_sem = None
+        self._loads = orjson.loads
+        self._last_ts = 0.0
+        # Least recently used first
+        self._search_cache: OrderedDict[Tuple[str, int], Tuple[float, List[GameInfo]]] = OrderedDict()
+        # (appid, name, lowercased name) for every app on Steam, used for local search
+        self._applist: List[Tuple[int, str, str]] = []
+        self._applist_task = None
         
     async def start(self):
         """Initialize the client session"""
         if self.session is None:
-            self.session = aiohttp.ClientSession()
-            log_command(logger, logging.INFO, "Steam API client session initialized", command="start")
+            connector = aiohttp.TCPConnector(
+                resolver=aiohttp.AsyncResolver(),
+                use_dns_cache=True,
+                ttl_dns_cache=600,
+                limit=64,
+                limit_per_host=16,
+                keepalive_timeout=75
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT)
+            self._rate_sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            self._applist_task = asyncio.create_task(self._refresh_applist_loop())
+            log_command(logger, INFO, "Steam API client session initialized", command="start")
             
     async def close(self):
         """Clean up resources"""
+        if self._applist_task is not None:
+            self._applist_task.cancel()
+            self._applist_task = None
         if self.session is not None:
             await self.session.close()
             self.session = None
-            log_command(logger, logging.INFO, "Steam API client session closed", command="close")
-    
-    async def get_top_games(self, limit: int = 10) -> List[Dict]:
+            log_command(logger, INFO, "Steam API client session closed", command="close")
+
+    async def store_get(self, url: str) -> Dict:
+        """Fetch a Steam Store API URL through the shared session"""
+        return await self._http_json(url)
+
+    async def get_app_details(self, appid: int) -> Dict:
+        """Get Store details for a game"""
+        store_url = f"https://store.steampowered.com/api/appdetails?appids={appid}&filters={APPDETAILS_FILTERS}"
+        log_command(logger, INFO, f"Fetching game details for {appid}", command="get_app_details")
+        details = await self.store_get(store_url)
+        return (details.get(str(appid)) or {}).get('data', {})
+
+    async def get_top_games(self, limit: int = 10) -> List[GameInfo]:
         """Get top games by current player count"""
-        log_command(logger, logging.INFO, f"Fetching top {limit} games by player count", command="get_top_games")
+        log_command(logger, INFO, f"Fetching top {limit} games by player count", command="get_top_games")
         try:
-            # Most popular Steam games
-            popular_games = [
-                730,    # CS2
-                570,    # Dota 2
-                440,    # Team Fortress 2
-                578080, # PUBG
-                252490, # Rust
-                1172470,# Apex Legends
-                1938090,# Counter-Strike 2
-                346110, # ARK
-                271590, # GTA V
-                1599340,# Lost Ark
-                1172620,# Baldur's Gate 3
-                359550, # Rainbow Six Siege
-                230410, # Warframe
-                548430, # Deep Rock Galactic
-                1949440 # Palworld
-            ]
+            counts = await asyncio.gather(*(self.get_player_count(game.appid) for game in POPULAR_GAMES))
 
             results = []
-            for appid in popular_games:
-                try:
-                    # Get game details from Steam Store API
-                    store_url = f"https://store.steampowered.com/api/appdetails?appids={appid}"
-                    log_command(logger, logging.INFO, f"Fetching game details for {appid}", command="get_top_games")
-                    
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(store_url) as response:
-                            if response.status == 200:
-                                details = await response.json()
-                                game_data = details.get(str(appid), {}).get('data', {})
-                                
-                                if game_data:
-                                    # Get current players
-                                    player_data = await self._make_request(
-                                        "ISteamUserStats/GetNumberOfCurrentPlayers/v1",
-                                        {'appid': appid}
-                                    )
-                                    
-                                    player_count = player_data.get('player_count', 0)
-                                    if player_count > 0:
-                                        results.append({
-                                            'appid': appid,
-                                            'name': game_data.get('name', f'Game {appid}'),
-                                            'player_count': player_count,
-                                            'peak_today': player_count,  # Steam API limitation
-                                            'header_image': game_data.get('header_image', ''),
-                                            'genres': [g.get('description', '') for g in game_data.get('genres', [])]
-                                        })
-                                        log_command(logger, logging.INFO, 
-                                                  f"Found {player_count:,} players for {game_data.get('name')}", 
-                                                  command="get_top_games")
-                
-                except Exception as e:
-                    log_command(logger, logging.ERROR, 
-                              f"Error fetching data for game {appid}: {str(e)}", 
-                              command="get_top_games")
-                    continue
+            for game, stats in zip(POPULAR_GAMES, counts):
+                player_count = stats['player_count']
+                if player_count > 0:
+                    # Steam API limitation: no peak data, so report the current count
+                    results.append(game._replace(player_count=player_count, peak_today=player_count))
             
             # Sort by player count and return top N
-            results.sort(key=lambda x: x['player_count'], reverse=True)
-            log_command(logger, logging.INFO, 
+            results.sort(key=lambda x: x.player_count, reverse=True)
+            log_command(logger, INFO, 
                        f"Successfully fetched {len(results)} games", 
                        command="get_top_games")
             return results[:limit]
             
         except Exception as e:
-            log_command(logger, logging.ERROR, 
+            log_command(logger, ERROR, 
                        f"Failed to get top games: {str(e)}", 
                        command="get_top_games")
             return []
 
     async def _make_request(self, endpoint: str, params: Dict) -> Dict:
-        """Make API request with retries and error handling"""
+        """Make Steam Web API request and return its response payload"""
+        params['key'] = Config.STEAM_API_KEY
+        url = f"{self.base_url}/{endpoint}"
+        data = await self._http_json(url, params)
+        return data.get('response', {})
+
+    async def _http_json(self, url: str, params: Optional[Dict] = None,
+                         timeout: Optional[aiohttp.ClientTimeout] = None) -> Dict:
+        """Rate-limited GET returning decoded JSON, retried with exponential backoff"""
         if self.session is None:
-            log_command(logger, logging.ERROR, 
+            log_command(logger, ERROR, 
                        "API client not initialized", 
-                       command="_make_request")
+                       command="_http_json")
             raise SteamAPIError("API client not initialized. Call start() first.")
-            
-        params['key'] = Config.STEAM_API_KEY
-        url = f"{self.base_url}/{endpoint}"
-        
-        for attempt in range(3):
+
+        last_error = None
+        for attempt in range(MAX_RETRIES):
+            delay = RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, RETRY_JITTER)
             try:
-                log_command(logger, logging.INFO, 
-                          f"Making request to {endpoint} (Attempt {attempt + 1}/3)", 
-                          command="_make_request")
-                          
-                async with self.session.get(url, params=params) as response:
-                    if response.status == 429:
-                        self.retry_delay *= 2
-                        log_command(logger, logging.WARNING, 
-                                  f"Rate limited. Retrying in {self.retry_delay}s", 
-                                  command="_make_request")
-                        await asyncio.sleep(self.retry_delay)
-                        continue
-                        
-                    data = await response.json()
-                    if response.status != 200:
-                        log_command(logger, logging.ERROR, 
-                                  f"API request failed: {response.status}", 
-                                  command="_make_request")
-                        raise SteamAPIError(f"API request failed: {response.status}")
+                async with self._rate_sem:
+                    await self._throttle()
+                    log_command(logger, DEBUG, 
+                              f"Requesting {url} (Attempt {attempt + 1}/{MAX_RETRIES})", 
+                              command="_http_json")
+                    async with self.session.get(url, params=params, timeout=timeout or REQUEST_TIMEOUT) as response:
+                        if response.status == 200:
+                            body = await response.read()
+                            try:
+                                return self._loads(body)
+                            except orjson.JSONDecodeError as e:
+                                # Steam sometimes answers 200 with an HTML error page
+                                raise SteamAPIError(f"Invalid JSON response: {str(e)}") from e
+
+                        last_error = SteamAPIError(f"API request failed: {response.status}", response.status)
+                        if response.status == 429:
+                            delay = max(delay, self._retry_after(response.headers))
+                        elif response.status < 500:
+                            log_command(logger, ERROR, 
+                                      f"API request failed: {response.status}", 
+                                      command="_http_json")
+                            raise last_error
                         
-                    log_command(logger, logging.INFO, 
-                              "Request successful", 
-                              command="_make_request")
-                    return data.get('response', {})
-                    
-            except aiohttp.ClientError as e:
-                if attempt == 2:
-                    log_command(logger, logging.ERROR, 
-                              f"Network error: {str(e)}", 
-                              command="_make_request")
-                    raise SteamAPIError(f"Network error: {str(e)}")
-                await asyncio.sleep(self.retry_delay)
-                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = SteamAPIError(f"Network error: {str(e)}")
+
+            if attempt < MAX_RETRIES - 1:
+                delay = min(delay, MAX_RETRY_DELAY)
+                log_command(logger, WARNING, 
+                          f"{last_error}. Retrying in {delay:.1f}s", 
+                          command="_http_json")
+                await asyncio.sleep(delay)
+
+        log_command(logger, ERROR, 
+                   f"Giving up after {MAX_RETRIES} attempts: {last_error}", 
+                   command="_http_json")
+        raise last_error
+
+    async def _throttle(self):
+        """Space out request starts by at least MIN_REQUEST_INTERVAL"""
+        now = time.monotonic()
+        wait = self._last_ts + MIN_REQUEST_INTERVAL - now
+        # Reserve the next slot before sleeping so concurrent callers queue up behind it
+        self._last_ts = max(now, self._last_ts + MIN_REQUEST_INTERVAL)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def _retry_after(headers) -> float:
+        """Seconds to wait as advertised by rate-limit response headers"""
+        retry_after = headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+        reset = headers.get('X-RateLimit-Reset')
+        if reset is not None:
+            try:
+                reset = float(reset)
+            except ValueError:
+                return 0.0
+            # Either an absolute epoch timestamp or a number of seconds
+            return max(0.0, reset - time.time()) if reset > 1e9 else reset
+
+        return 0.0
                 
-    async def search_games(self, query: str, limit: int = 5) -> List[Dict]:
+    async def search_games(self, query: str, limit: int = 5) -> List[GameInfo]:
         """Search for games by name"""
         if not query:
             return []
             
+        cache_key = (query.lower(), limit)
+        cached = self._get_cached_search(cache_key)
+        if cached is not None:
+            return cached
+            
+        results = self._search_applist(query, limit)
+        if results:
+            log_command(logger, INFO, 
+                      f"Found {len(results)} games matching '{query}' in app list", 
+                      command="search_games")
+            self._cache_search(cache_key, results)
+            return results
+            
         try:
-            log_command(logger, logging.INFO, f"Searching for game: {query}", command="search_games")
-            # Use Steam Store API for search
+            log_command(logger, INFO, f"Searching for game: {query}", command="search_games")
+            # Fall back to Steam Store API for search
             search_url = f"https://store.steampowered.com/api/storesearch?term={query}&l=english&cc=US"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(search_url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('total', 0) > 0:
-                            results = []
-                            for item in data.get('items', [])[:limit]:
-                                results.append({
-                                    'appid': item.get('id'),
-                                    'name': item.get('name'),
-                                    'type': item.get('type')
-                                })
-                            log_command(logger, logging.INFO, 
-                                      f"Found {len(results)} games matching '{query}'", 
-                                      command="search_games")
-                            return results
+            data = await self.store_get(search_url)
+            if data.get('total', 0) > 0:
+                results = [GameInfo(item.get('id'), item.get('name')) for item in data.get('items', [])[:limit]]
+                log_command(logger, INFO, 
+                          f"Found {len(results)} games matching '{query}'", 
+                          command="search_games")
+                self._cache_search(cache_key, results)
+                return results
             
-            log_command(logger, logging.WARNING, 
+            log_command(logger, WARNING, 
                        f"No games found matching '{query}'", 
                        command="search_games")
+            self._cache_search(cache_key, [])
             return []
             
         except Exception as e:
-            log_command(logger, logging.ERROR, 
+            log_command(logger, ERROR, 
                        f"Search error: {str(e)}", 
                        command="search_games")
             return []
 
+    def is_search_cached(self, query: str, limit: int = 5) -> bool:
+        """Whether search_games can answer this query without a network request"""
+        return self._get_cached_search((query.lower(), limit)) is not None
+
+    def _get_cached_search(self, cache_key: Tuple[str, int]) -> Optional[List[GameInfo]]:
+        """Return fresh cached search results, dropping the entry if it has expired"""
+        cached = self._search_cache.get(cache_key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] >= SEARCH_TTL:
+            del self._search_cache[cache_key]
+            return None
+        self._search_cache.move_to_end(cache_key)
+        return cached[1]
+
+    def _cache_search(self, cache_key: Tuple[str, int], results: List[GameInfo]):
+        """Cache search results, evicting the least recently used query once full"""
+        self._search_cache[cache_key] = (time.monotonic(), results)
+        self._search_cache.move_to_end(cache_key)
+        if len(self._search_cache) > SEARCH_CACHE_SIZE:
+            self._search_cache.popitem(last=False)
+
+    def _search_applist(self, query: str, limit: int) -> List[GameInfo]:
+        """Match a query against the cached Steam app list, best matches first"""
+        needle = query.lower()
+        matches = [app for app in self._applist if needle in app[2]]
+        # Exact names first, then prefix matches, then shorter names
+        best = heapq.nsmallest(
+            limit, matches,
+            key=lambda app: (app[2] != needle, not app[2].startswith(needle), len(app[2]))
+        )
+        # The app list has DLC, soundtracks and tools but no relevance ranking, so a bare
+        # substring hit is left to the store search rather than risk !track picking it
+        if not best or not best[0][2].startswith(needle):
+            return []
+        return [GameInfo(appid, name) for appid, name, _ in best]
+
+    async def _refresh_applist_loop(self):
+        """Keep the local Steam app list fresh for search_games"""
+        retry_delay = APPLIST_RETRY_DELAY
+        while True:
+            try:
+                data = await self._http_json(f"{self.base_url}/ISteamApps/GetAppList/v2/", timeout=APPLIST_TIMEOUT)
+                self._applist = [
+                    (app['appid'], app['name'], app['name'].lower())
+                    for app in data.get('applist', {}).get('apps', [])
+                    if app.get('name')
+                ]
+                log_command(logger, INFO, 
+                          f"Loaded {len(self._applist):,} apps for local search", 
+                          command="refresh_applist")
+            except Exception as e:
+                log_command(logger, ERROR, 
+                          f"Failed to refresh app list, retrying in {retry_delay}s: {str(e)}", 
+                          command="refresh_applist")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, APPLIST_MAX_RETRY_DELAY)
+                continue
+            retry_delay = APPLIST_RETRY_DELAY
+            await asyncio.sleep(APPLIST_REFRESH_INTERVAL)
+
     async def get_player_count(self, appid: int) -> Dict:
         """Get current player count for a game"""
-        log_command(logger, logging.INFO, 
+        log_command(logger, INFO, 
                    f"Fetching player count for game {appid}", 
                    command="get_player_count")
         try:
             data = await self._make_request("ISteamUserStats/GetNumberOfCurrentPlayers/v1", {'appid': appid})
             count = data.get('player_count', 0)
-            log_command(logger, logging.INFO, 
+            log_command(logger, INFO, 
                        f"Found {count:,} players for game {appid}", 
                        command="get_player_count")
             return {'player_count': count}
         except Exception as e:
-            log_command(logger, logging.ERROR, 
+            log_command(logger, ERROR, 
                        f"Failed to get player count: {str(e)}", 
                        command="get_player_count")
             return {'player_count': 0}
\ No newline at end of file
@@ -1,77 +1,253 @@
-import json
+import msgpack
+import orjson
 import os
-from datetime import datetime
-from typing import Dict, List, Optional
-from utils import setup_logging, log_command
-import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+from utils import setup_logging, log_command, INFO, ERROR
 
 logger = setup_logging()
 
+# Notification message templates; only the game name and values vary between messages
+_PRICE_TMPL = "💰 Price Update: {name}\nPrevious: {prev}\nNew: {new}"
+_RELEASE_DATE_TMPL = "📅 Release Date Changed: {name}\nPrevious: {prev}\nNew: {new}"
+_PREORDER_TMPL = "🎮 Pre-order Status Update: {name}\nNow {new} for pre-order!"
+_PREORDER_LABELS = {True: 'available', False: 'unavailable'}
+
 class GameTracker:
-    def __init__(self):
+    # (current_data field, notification type, notify when previously unset, message template, value labels)
+    _FIELDS = (
+        ('price', 'price', False, _PRICE_TMPL, None),
+        ('release_date', 'release_date', False, _RELEASE_DATE_TMPL, None),
+        ('preorder_status', 'preorder', True, _PREORDER_TMPL, _PREORDER_LABELS),
+    )
+
+    def __init__(self, flush_interval: float = 5.0):
         self.tracked_games = {}
-        self.data_file = "game_tracking.json"
+        # Working data lives in msgpack; JSON is only read once for migration and written on export
+        self.data_file = "game_tracking.msgpack"
+        self.json_file = "game_tracking.json"
+        # Mutations only mark the data dirty; it is written at most once per flush_interval
+        self._dirty = False
+        self._flush_interval = flush_interval
+        self._batch_depth = 0
+        # Saves are handed to a background writer thread: None means "data changed",
+        # a threading.Event means "write now and set this once done"
+        self._save_queue: queue.Queue = queue.Queue()
+        # Guards tracked_games against the writer thread copying it mid-mutation
+        self._lock = threading.Lock()
+        # Reused for every save instead of configuring a new packer each time
+        self._packer = msgpack.Packer(use_bin_type=True)
+        # Inverse indexes from channel and (channel, user) to the game keys they watch
+        self._by_channel: Dict[str, Set[str]] = {}
+        self._by_channel_user: Dict[Tuple[str, int], Set[str]] = {}
+        # Position of each game in tracked_games, so index lookups can be listed in tracking order
+        self._track_order: Dict[str, int] = {}
+        self._next_order = 0
+        # Materialized get_notification_channels results, dropped whenever a game's watchers change
+        self._notif_cache: Dict[str, List[Dict]] = {}
         self._load_tracking_data()
+        self._writer = threading.Thread(target=self._writer_loop, name="tracker-writer", daemon=True)
+        self._writer.start()
 
     def _load_tracking_data(self):
         """Load tracking data from file"""
         try:
+            migrated = False
             if os.path.exists(self.data_file):
-                with open(self.data_file, 'r') as f:
-                    self.tracked_games = json.load(f)
-                log_command(logger, logging.INFO, 
-                          f"Loaded {len(self.tracked_games)} tracked games", 
+                with open(self.data_file, 'rb') as f:
+                    data = f.read()
+                self.tracked_games = msgpack.unpackb(data, raw=False)
+            elif os.path.exists(self.json_file):
+                # Older versions stored everything as JSON; convert it on first load
+                with open(self.json_file, 'rb') as f:
+                    data = f.read()
+                self.tracked_games = orjson.loads(data)
+                migrated = True
+            else:
+                return
+
+            # Watchers are kept as sets in memory and stored as lists on disk
+            for game_data in self.tracked_games.values():
+                game_data['watchers'] = {
+                    channel_key: set(users) for channel_key, users in game_data['watchers'].items()
+                }
+            self._build_indexes()
+            log_command(logger, INFO, 
+                      f"Loaded {len(self.tracked_games)} tracked games", 
+                      command="load_tracking_data")
+            if migrated:
+                self._save_tracking_data()
+                log_command(logger, INFO, 
+                          f"Migrated tracking data from {self.json_file} to {self.data_file}", 
                           command="load_tracking_data")
         except Exception as e:
-            log_command(logger, logging.ERROR, 
+            log_command(logger, ERROR, 
                        f"Failed to load tracking data: {str(e)}", 
                        command="load_tracking_data")
 
+    def _build_indexes(self):
+        """Rebuild the channel and user indexes from tracked_games"""
+        self._by_channel = {}
+        self._by_channel_user = {}
+        self._track_order = {game_key: order for order, game_key in enumerate(self.tracked_games)}
+        self._next_order = len(self._track_order)
+        for game_key, game_data in self.tracked_games.items():
+            for channel_key, users in game_data['watchers'].items():
+                self._by_channel.setdefault(channel_key, set()).add(game_key)
+                for user_id in users:
+                    self._by_channel_user.setdefault((channel_key, user_id), set()).add(game_key)
+
+    @staticmethod
+    def _unindex(index: Dict, key, game_key: str):
+        """Remove a game from an index entry, dropping the entry once empty"""
+        game_keys = index.get(key)
+        if game_keys is not None:
+            game_keys.discard(game_key)
+            if not game_keys:
+                del index[key]
+
+    def flush(self):
+        """Write tracking data to disk if there are unsaved changes, waiting for the write"""
+        done = threading.Event()
+        self._save_queue.put(done)
+        done.wait()
+
+    @contextmanager
+    def batched(self):
+        """Group several mutations into a single save when the block exits"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
+
+    def _mark_dirty(self):
+        """Let the writer thread know there are unsaved changes"""
+        self._dirty = True
+        if self._batch_depth == 0:
+            self._save_queue.put(None)
+
+    def _writer_loop(self):
+        """Coalesce queued save requests and write each burst once"""
+        while True:
+            waiters = []
+            request = self._save_queue.get()
+            if request is None:
+                # Give further changes flush_interval to pile up, unless someone flushes first
+                deadline = time.monotonic() + self._flush_interval
+                while request is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        request = self._save_queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+            if request is not None:
+                waiters.append(request)
+
+            # Everything still queued is covered by the write below
+            while True:
+                try:
+                    request = self._save_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None:
+                    waiters.append(request)
+
+            if self._dirty:
+                self._dirty = False
+                self._save_tracking_data()
+            for done in waiters:
+                done.set()
+
+    def _snapshot(self) -> Dict:
+        """Copy tracked_games deep enough that later mutations don't show up in the copy"""
+        return {
+            game_key: {
+                **game_data,
+                'watchers': {channel_key: list(users) for channel_key, users in game_data['watchers'].items()},
+                'current_data': {**game_data['current_data']}
+            }
+            for game_key, game_data in self.tracked_games.items()
+        }
+
     def _save_tracking_data(self):
         """Save tracking data to file"""
         try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.tracked_games, f, indent=2)
-            log_command(logger, logging.INFO, 
+            # Copy under the lock so mutations only wait for the copy, not the encode and write
+            with self._lock:
+                snapshot = self._snapshot()
+            # Encode up front so the file is written with a single write() call
+            payload = self._packer.pack(snapshot)
+            # Write to a temp file and swap it in so a crash never leaves a truncated file
+            tmp_file = self.data_file + ".tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_file, self.data_file)
+            log_command(logger, INFO, 
                        "Saved tracking data", 
                        command="save_tracking_data")
         except Exception as e:
-            log_command(logger, logging.ERROR, 
+            log_command(logger, ERROR, 
                        f"Failed to save tracking data: {str(e)}", 
                        command="save_tracking_data")
 
+    def export_json(self, path: Optional[str] = None):
+        """Write a human-readable JSON copy of the tracking data"""
+        path = path or self.json_file
+        with self._lock:
+            snapshot = self._snapshot()
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(snapshot, option=orjson.OPT_INDENT_2))
+        log_command(logger, INFO, 
+                   f"Exported tracking data to {path}", 
+                   command="export_json")
+
     def track_game(self, game_id: int, game_name: str, channel_id: int, user_id: int) -> bool:
         """Start tracking a game"""
         try:
-            game_key = str(game_id)
-            if game_key not in self.tracked_games:
-                self.tracked_games[game_key] = {
-                    'id': game_id,
-                    'name': game_name,
-                    'watchers': {},
-                    'last_check': None,
-                    'current_data': {
-                        'price': None,
-                        'release_date': None,
-                        'preorder_status': False,
-                        'last_update': None
+            with self._lock:
+                game_key = str(game_id)
+                if game_key not in self.tracked_games:
+                    self.tracked_games[game_key] = {
+                        'id': game_id,
+                        'name': game_name,
+                        'watchers': {},
+                        'last_check': None,
+                        'current_data': {
+                            'price': None,
+                            'release_date': None,
+                            'preorder_status': False,
+                            'last_update': None
+                        }
                     }
-                }
+                    self._track_order[game_key] = self._next_order
+                    self._next_order += 1
             
-            # Add channel and user to watchers
-            if str(channel_id) not in self.tracked_games[game_key]['watchers']:
-                self.tracked_games[game_key]['watchers'][str(channel_id)] = []
+                # Add channel and user to watchers
+                channel_key = str(channel_id)
+                watchers = self.tracked_games[game_key]['watchers']
+                if channel_key not in watchers:
+                    watchers[channel_key] = set()
+                watchers[channel_key].add(user_id)
             
-            if user_id not in self.tracked_games[game_key]['watchers'][str(channel_id)]:
-                self.tracked_games[game_key]['watchers'][str(channel_id)].append(user_id)
+                self._by_channel.setdefault(channel_key, set()).add(game_key)
+                self._by_channel_user.setdefault((channel_key, user_id), set()).add(game_key)
+                self._notif_cache.pop(game_key, None)
             
-            self._save_tracking_data()
-            log_command(logger, logging.INFO,
+            self._mark_dirty()
+            log_command(logger, INFO,
                        f"Started tracking {game_name} (ID: {game_id}) for user {user_id} in channel {channel_id}",
                        command="track_game")
             return True
         except Exception as e:
-            log_command(logger, logging.ERROR,
+            log_command(logger, ERROR,
                        f"Failed to track game {game_name}: {str(e)}",
                        command="track_game")
             return False
@@ -80,125 +256,133 @@ class GameTracker:
         """Stop tracking a game for a user in a channel"""
         try:
             game_key = str(game_id)
-            if game_key in self.tracked_games:
+            game = self.tracked_games.get(game_key)
+            if game is not None:
                 channel_key = str(channel_id)
-                if channel_key in self.tracked_games[game_key]['watchers']:
-                    if user_id in self.tracked_games[game_key]['watchers'][channel_key]:
-                        self.tracked_games[game_key]['watchers'][channel_key].remove(user_id)
+                watchers = game['watchers']
+                channel_watchers = watchers.get(channel_key)
+                if channel_watchers is not None:
+                    if user_id in channel_watchers:
+                        with self._lock:
+                            channel_watchers.discard(user_id)
+                            self._unindex(self._by_channel_user, (channel_key, user_id), game_key)
                         
-                        # Clean up if no watchers left
-                        if not self.tracked_games[game_key]['watchers'][channel_key]:
-                            del self.tracked_games[game_key]['watchers'][channel_key]
-                        if not self.tracked_games[game_key]['watchers']:
-                            del self.tracked_games[game_key]
+                            # Clean up if no watchers left
+                            if not channel_watchers:
+                                del watchers[channel_key]
+                                self._unindex(self._by_channel, channel_key, game_key)
+                            if not watchers:
+                                del self.tracked_games[game_key]
+                                del self._track_order[game_key]
+                            self._notif_cache.pop(game_key, None)
                         
-                        self._save_tracking_data()
-                        log_command(logger, logging.INFO,
+                        self._mark_dirty()
+                        log_command(logger, INFO,
                                   f"Stopped tracking game {game_id} for user {user_id} in channel {channel_id}",
                                   command="untrack_game")
                         return True
             return False
         except Exception as e:
-            log_command(logger, logging.ERROR,
+            log_command(logger, ERROR,
                        f"Failed to untrack game {game_id}: {str(e)}",
                        command="untrack_game")
             return False
 
     def get_tracked_games(self, channel_id: Optional[int] = None, user_id: Optional[int] = None) -> List[Dict]:
         """Get list of tracked games, optionally filtered by channel and/or user"""
-        try:
-            results = []
-            for game_id, game_data in self.tracked_games.items():
-                if channel_id is not None:
-                    channel_key = str(channel_id)
-                    if channel_key not in game_data['watchers']:
-                        continue
-                    if user_id is not None and user_id not in game_data['watchers'][channel_key]:
-                        continue
-                results.append({
-                    'id': game_data['id'],
-                    'name': game_data['name'],
-                    'current_data': game_data['current_data']
-                })
-            return results
-        except Exception as e:
-            log_command(logger, logging.ERROR,
-                       f"Failed to get tracked games: {str(e)}",
-                       command="get_tracked_games")
-            return []
+        channel_key = str(channel_id) if channel_id is not None else None
+        if channel_key is None:
+            game_keys = self.tracked_games.keys()
+        else:
+            if user_id is None:
+                game_keys = self._by_channel.get(channel_key, ())
+            else:
+                game_keys = self._by_channel_user.get((channel_key, user_id), ())
+            # Index sets have no stable order; list games in the order they were tracked
+            game_keys = sorted(game_keys, key=self._track_order.__getitem__)
+            
+        tracked_games = self.tracked_games
+        results = []
+        for game_key in game_keys:
+            game_data = tracked_games[game_key]
+            results.append({
+                'id': game_data['id'],
+                'name': game_data['name'],
+                'current_data': game_data['current_data']
+            })
+        return results
 
     def update_game_data(self, game_id: int, price: Optional[str] = None, 
                         release_date: Optional[str] = None, preorder_status: Optional[bool] = None,
-                        last_update: Optional[str] = None) -> List[Dict]:
+                        last_update: Optional[int] = None) -> List[Dict]:
         """Update game data and return notifications if there are changes"""
-        try:
-            game_key = str(game_id)
-            if game_key not in self.tracked_games:
-                return []
-
-            notifications = []
-            current = self.tracked_games[game_key]['current_data']
-            game_name = self.tracked_games[game_key]['name']
-
-            # Check for changes and create notifications
-            if price is not None and price != current['price']:
-                if current['price'] is not None:
-                    notifications.append({
-                        'type': 'price',
-                        'message': f"💰 Price Update: {game_name}\n"
-                                 f"Previous: {current['price']}\n"
-                                 f"New: {price}"
-                    })
-                current['price'] = price
-
-            if release_date is not None and release_date != current['release_date']:
-                if current['release_date'] is not None:
-                    notifications.append({
-                        'type': 'release_date',
-                        'message': f"📅 Release Date Changed: {game_name}\n"
-                                 f"Previous: {current['release_date']}\n"
-                                 f"New: {release_date}"
-                    })
-                current['release_date'] = release_date
-
-            if preorder_status is not None and preorder_status != current['preorder_status']:
-                notifications.append({
-                    'type': 'preorder',
-                    'message': f"🎮 Pre-order Status Update: {game_name}\n"
-                             f"Now {'available' if preorder_status else 'unavailable'} for pre-order!"
-                })
-                current['preorder_status'] = preorder_status
+        game = self.tracked_games.get(str(game_id))
+        if game is None:
+            return []
+
+        notifications = []
+        current = game['current_data']
+        game_name = game['name']
+
+        updates = {'price': price, 'release_date': release_date, 'preorder_status': preorder_status}
 
+        changed = False
+
+        with self._lock:
+            # Check for changes and create notifications, only formatting messages for changed fields
+            for field, kind, notify_unset, template, labels in self._FIELDS:
+                new = updates[field]
+                old = current[field]
+                if new is None or new == old:
+                    continue
+                if old is not None or notify_unset:
+                    shown = labels[new] if labels is not None else new
+                    message = template.format_map({'name': game_name, 'prev': old, 'new': shown})
+                    notifications.append({'type': kind, 'message': message})
+                current[field] = new
+                changed = True
+
+            # The poll timestamps change on every check; they are kept up to date in
+            # memory but only written out alongside a real change
             if last_update is not None:
                 current['last_update'] = last_update
 
-            self.tracked_games[game_key]['last_check'] = datetime.now().isoformat()
-            self._save_tracking_data()
-
-            return notifications
+            game['last_check'] = int(time.time())
+        if changed:
+            self._mark_dirty()
 
-        except Exception as e:
-            log_command(logger, logging.ERROR,
-                       f"Failed to update game data for {game_id}: {str(e)}",
-                       command="update_game_data")
-            return []
+        return notifications
 
     def get_notification_channels(self, game_id: int) -> List[Dict]:
         """Get channels and users to notify for a game"""
-        try:
-            game_key = str(game_id)
-            if game_key not in self.tracked_games:
-                return []
-
-            channels = []
-            for channel_id, users in self.tracked_games[game_key]['watchers'].items():
-                channels.append({
-                    'channel_id': int(channel_id),
-                    'users': users
-                })
-            return channels
-        except Exception as e:
-            log_command(logger, logging.ERROR,
-                       f"Failed to get notification channels for {game_id}: {str(e)}",
-                       command="get_notification_channels")
-            return []
\ No newline at end of file
+        game_key = str(game_id)
+        cached = self._notif_cache.get(game_key)
+        if cached is not None:
+            return cached
+
+        game = self.tracked_games.get(game_key)
+        if game is None:
+            return []
+
+        channels = []
+        for channel_id, users in game['watchers'].items():
+            channels.append({
+                'channel_id': int(channel_id),
+                'users': users
+            })
+        self._notif_cache[game_key] = channels
+        return channels
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the bot's game tracking data")
+    parser.add_argument('--export-json', nargs='?', const='game_tracking.json', metavar='PATH',
+                        help="write the tracking data as JSON (default: game_tracking.json)")
+    args = parser.parse_args()
+
+    if args.export_json:
+        GameTracker().export_json(args.export_json)
+    else:
+        parser.print_help()
\ No newline at end of file
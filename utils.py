@@ -1,11 +1,18 @@
+import functools
 import logging
+import logging.handlers
 import os
-from datetime import datetime
 from colorama import init, Fore, Style
 
 # Initialize colorama for Windows support
 init()
 
+# Re-exported so callers can pass levels to log_command without going through logging
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
 class ColoredFormatter(logging.Formatter):
     """Custom formatter with colors and detailed information"""
     
@@ -17,31 +24,32 @@ class ColoredFormatter(logging.Formatter):
         'CRITICAL': Fore.RED + Style.BRIGHT
     }
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Wrap each level name in its color once instead of on every record
+        self._colored_levels = {
+            level: f"{color}{level}{Style.RESET_ALL}" for level, color in self.COLORS.items()
+        }
+    
     def format(self, record):
         # Add colors to level names in console output
-        levelname = record.levelname
-        if levelname in self.COLORS:
-            record.levelname = f"{self.COLORS[levelname]}{levelname}{Style.RESET_ALL}"
-            
-        # Add user and command info if available
-        if hasattr(record, 'user'):
-            record.user_info = f" | User: {record.user}"
-        else:
-            record.user_info = ""
+        record.levelname = self._colored_levels.get(record.levelname, record.levelname)
             
-        if hasattr(record, 'command'):
-            record.command_info = f" | Command: {record.command}"
-        else:
-            record.command_info = ""
+        # Add user and command info if available (set through log_command's extra)
+        fields = record.__dict__
+        user = fields.get('user')
+        record.user_info = f" | User: {user}" if user is not None else ""
+        command = fields.get('command')
+        record.command_info = f" | Command: {command}" if command is not None else ""
             
         return super().format(record)
 
+@functools.lru_cache(maxsize=1)
 def setup_logging():
-    """Set up logging with both file and console output"""
+    """Set up logging with both file and console output (built once, then cached)"""
     
     # Create logs directory if it doesn't exist
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
+    os.makedirs('logs', exist_ok=True)
         
     # Create logger
     logger = logging.getLogger('steam_bot')
@@ -60,9 +68,9 @@ def setup_logging():
     )
     console_handler.setFormatter(console_format)
     
-    # File handler with detailed information
-    today = datetime.now().strftime('%Y-%m-%d')
-    file_handler = logging.FileHandler(f'logs/steam_bot_{today}.log')
+    # File handler with detailed information, rolled over at midnight so a
+    # long-running bot doesn't keep writing to the day it was started on
+    file_handler = logging.handlers.TimedRotatingFileHandler('logs/steam_bot.log', when='midnight')
     file_handler.setLevel(logging.DEBUG)
     file_format = logging.Formatter(
         '%(asctime)s | %(levelname)-8s | %(name)s | User: %(user)s | Command: %(command)s | %(message)s',
@@ -79,6 +87,9 @@ def setup_logging():
 # Create a function to add context to log records
 def log_command(logger, level, message, user=None, command=None):
     """Log with additional context for Discord commands"""
+    # Skip building the extra dict for records that would be filtered out anyway
+    if not logger.isEnabledFor(level):
+        return
     extra = {
         'user': user if user else 'System',
         'command': command if command else 'None'